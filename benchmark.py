@@ -0,0 +1,114 @@
+"""
+Benchmarks of the SIR model, run with `python3 benchmark.py`.
+Reports the memory used by each agent, the time to read the agent attributes used by the model and visualization, the time per model step, the overhead of the transmission log and the startup time of the process pools of headless workers.
+"""
+
+import multiprocessing
+import tempfile
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from model import *
+from recorder import TransmissionLog
+
+
+def bench_agent_memory(n_agents=2000):
+    """Bytes allocated per agent, measured as the difference between a model with and without agents"""
+    empty = dict(n_adults=0, n_children=0, n_elderly=0, n_pregnant=0)
+    empty.update(infect_adults=0, infect_children=0, infect_elderly=0)
+    empty.update(infect_pregnant=0)
+    full = dict(n_adults=n_agents // 4, n_children=n_agents // 4)
+    full.update(n_elderly=n_agents // 4, n_pregnant=n_agents // 4)
+
+    sizes = []
+    for overrides in (empty, full):
+        tracemalloc.start()
+        model = SIR(**default_params(**overrides))
+        sizes.append(tracemalloc.get_traced_memory()[0])
+        tracemalloc.stop()
+        del model
+    return (sizes[1] - sizes[0]) / n_agents
+
+
+def bench_attribute_access(number=200):
+    """Seconds to read the state of every agent once, as the visualization and data collection do"""
+    model = SIR(**default_params())
+    agents = model.schedule.agents
+
+    def read_state():
+        for a in agents:
+            a.strata, a.infected, a.recovered, a.dead, a.type, a.pos
+
+    return min(timeit.repeat(read_state, number=number, repeat=5)) / number
+
+
+def time_steps(model, n_steps):
+    """Seconds per model step, including writing out the transmission log if the model has one"""
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        model.step()
+    if model.transmission_log is not None:
+        model.transmission_log.close()
+    return (time.perf_counter() - start) / n_steps
+
+
+def bench_step(n_steps=100, seed=0):
+    """Seconds per model step"""
+    return time_steps(SIR(**default_params(seed=seed)), n_steps)
+
+
+def bench_transmission_log(n_steps=100, repeat=15, capacity=64, seed=0):
+    """
+    Relative increase of the time per model step when the transmission log is on.
+    The models are seeded so that the runs with and without the log are identical, and the log is given a small capacity so that its batches are written during the run.
+    """
+    # A higher transmission probability keeps the epidemic going, so that there are infections to log
+    without_log = []
+    with_log = []
+    with tempfile.TemporaryDirectory() as path:
+        for _ in range(repeat):
+            model = SIR(**default_params(seed=seed, transmission=0.1))
+            without_log.append(time_steps(model, n_steps))
+            model = SIR(**default_params(seed=seed, transmission=0.1))
+            model.transmission_log = TransmissionLog(path, model, capacity=capacity)
+            with_log.append(time_steps(model, n_steps))
+    return min(with_log) / min(without_log) - 1
+
+
+def run_model(n_steps):
+    model = SIR(**default_params())
+    for _ in range(n_steps):
+        model.step()
+    return model.total_infected
+
+
+def bench_worker_startup(method, n_workers=4):
+    """
+    Seconds until every worker of a new process pool has run a model.
+    Spawned workers start a new interpreter and import the model themselves, forkserver workers are forked from a process that has imported it once.
+    """
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        context.set_forkserver_preload(["model"])
+    start = time.perf_counter()
+    with ProcessPoolExecutor(n_workers, mp_context=context) as pool:
+        list(pool.map(run_model, [1] * n_workers))
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    print(f"Agent memory: {bench_agent_memory():.0f} bytes per agent")
+    print(f"Attribute access: {bench_attribute_access() * 1e6:.1f} us per pass")
+    print(f"Model step: {bench_step() * 1e3:.2f} ms per step")
+    print(f"Transmission log overhead: {bench_transmission_log() * 100:.1f}%")
+    print(
+        f"Worker startup (spawn): {bench_worker_startup('spawn') * 1e3:.0f} ms for 4 workers"
+    )
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        # The first pool also starts the fork server, later pools reuse it
+        first = bench_worker_startup("forkserver")
+        later = bench_worker_startup("forkserver")
+        print(
+            f"Worker startup (forkserver): {first * 1e3:.0f} ms, then {later * 1e3:.0f} ms"
+        )
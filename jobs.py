@@ -0,0 +1,382 @@
+"""
+Local job API for running the SIR model in the background, without blocking the visualization server.
+
+POST /jobs                submit a job: {"params": {...}, "sweep": {"name": [values, ...]}, "steps": 100}
+GET /jobs/<id>            status of a job and the time series of its runs so far
+WS /jobs/<id>/stream      the time series of the runs of a job as they are produced
+
+A job runs the model once for every combination of the sweep values, on top of the given params and the defaults of the left panel.
+Identical submissions that are still queued or running are merged into the same job.
+"""
+
+import itertools
+import json
+import math
+import multiprocessing
+import threading
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from model import SIR, Parameter, default_params, model_params, store_capacity
+
+# Queue used by the worker processes to report the time series of their runs while they are running
+progress_queue = None
+
+
+def init_worker(queue):
+    global progress_queue
+    progress_queue = queue
+
+
+def worker_context():
+    """
+    Workers are forked from a server process that has already imported the model, instead of each starting a new interpreter and importing it.
+    The spawn start method is used where forkserver is not available, on Windows.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["jobs"])
+    return context
+
+
+def run_model(job_id, run, params, steps, report_every):
+    """Runs the model in a worker process and returns the time series of every model reporter"""
+    model = SIR(**default_params(**params))
+    reported = 0
+    for step in range(1, steps + 1):
+        model.step()
+        if (step % report_every == 0) | (step == steps):
+            rows = {
+                label: values[reported:]
+                for label, values in model.datacollector.model_vars.items()
+            }
+            progress_queue.put((job_id, run, rows))
+            reported = step
+    return model.datacollector.model_vars
+
+
+class QueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, key, runs, steps):
+        self.id = job_id
+        self.key = key
+        self.runs = runs
+        self.steps = steps
+        self.state = "queued"
+        self.error = None
+        self.finished_runs = 0
+        self.run_finished = [False for _ in runs]
+        self.series = [{} for _ in runs]
+        self.listeners = set()
+
+    def status(self):
+        return {
+            "id": self.id,
+            "state": self.state,
+            "runs": len(self.runs),
+            "finished_runs": self.finished_runs,
+            "steps": self.steps,
+            "error": self.error,
+        }
+
+    def add_rows(self, run, rows):
+        for label, values in rows.items():
+            self.series[run].setdefault(label, []).extend(values)
+
+
+class JobQueue:
+    """
+    Runs the submitted jobs on a pool of worker processes, one run per worker at a time.
+    At most max_pending jobs can be queued or running, further submissions are refused until some of them finish.
+    """
+
+    def __init__(
+        self,
+        n_workers=None,
+        max_pending=16,
+        max_runs=1000,
+        max_steps=10000,
+        max_finished=100,
+        report_every=10,
+    ):
+        self.n_workers = n_workers or multiprocessing.cpu_count()
+        self.max_pending = max_pending
+        self.max_runs = max_runs
+        self.max_steps = max_steps
+        self.max_finished = max_finished
+        self.report_every = report_every
+        self.jobs = OrderedDict()
+        self.pending_jobs = {}
+        self.pending_runs = deque()
+        self.n_running = 0
+        self.executor = None
+
+    def start(self):
+        # The pool is started on the first submission, from the server's event loop
+        self.io_loop = tornado.ioloop.IOLoop.current()
+        self.context = worker_context()
+        self.progress_queue = self.context.Queue()
+        self.start_pool()
+        threading.Thread(target=self.read_progress, daemon=True).start()
+
+    def start_pool(self):
+        """Starts a new pool of workers, replacing a broken one"""
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.executor = ProcessPoolExecutor(
+            self.n_workers,
+            mp_context=self.context,
+            initializer=init_worker,
+            initargs=(self.progress_queue,),
+        )
+
+    def parse(self, spec):
+        """Returns the runs and the number of steps of a job specification"""
+        params = spec.get("params", {})
+        sweep = spec.get("sweep", {})
+        steps = spec.get("steps", 100)
+        if not (isinstance(params, dict) & isinstance(sweep, dict)):
+            raise ValueError("params and sweep must be objects")
+        for name in list(params) + list(sweep):
+            if not (isinstance(model_params.get(name), Parameter) | (name == "seed")):
+                raise ValueError(f"Unknown parameter {name}")
+        for name, values in sweep.items():
+            if not (isinstance(values, list) and values):
+                raise ValueError(f"The sweep of {name} must be a non-empty list")
+        if not (isinstance(steps, int) and 0 < steps <= self.max_steps):
+            raise ValueError(f"steps must be between 1 and {self.max_steps}")
+
+        n_runs = 1
+        for values in sweep.values():
+            n_runs *= len(values)
+        if n_runs > self.max_runs:
+            raise ValueError(f"A job cannot have more than {self.max_runs} runs")
+
+        runs = []
+        for values in itertools.product(*sweep.values()):
+            run = dict(params)
+            run.update(zip(sweep, values))
+            self.check_run(run)
+            runs.append(run)
+        return runs, steps
+
+    def check_run(self, run):
+        """Raises a ValueError if the model cannot be run with the parameters of a run"""
+        for name, value in run.items():
+            if name == "seed":
+                if not ((value is None) or (type(value) is int)):
+                    raise ValueError("seed must be an integer")
+                continue
+            param = model_params[name]
+            if param.param_type == "checkbox":
+                if not isinstance(value, bool):
+                    raise ValueError(f"{name} must be true or false")
+                continue
+            # Parameters with an integer default and step, such as the number of agents, must be integers
+            if isinstance(param.value, int) & isinstance(param.step, int):
+                if type(value) is not int:
+                    raise ValueError(f"{name} must be an integer")
+            elif not ((type(value) in (int, float)) and math.isfinite(value)):
+                raise ValueError(f"{name} must be a number")
+            if not (param.min_value <= value <= param.max_value):
+                raise ValueError(
+                    f"{name} must be between {param.min_value} and {param.max_value}"
+                )
+
+        params = default_params(**run)
+        for strata in ("adults", "children", "elderly", "pregnant"):
+            if (
+                params[f"v_{strata}"] + params[f"infect_{strata}"]
+                > params[f"n_{strata}"]
+            ):
+                raise ValueError(
+                    f"v_{strata} + infect_{strata} cannot be more than n_{strata}"
+                )
+        if params["arrival_vaccinated"] + params["arrival_infected"] > 100:
+            raise ValueError(
+                "arrival_vaccinated + arrival_infected cannot be more than 100"
+            )
+        n_agents = sum(
+            params[f"n_{strata}"]
+            for strata in ("adults", "children", "elderly", "pregnant")
+        )
+        capacity = store_capacity(params["width"], params["height"])
+        if n_agents > capacity:
+            raise ValueError(
+                f"{n_agents} agents do not fit in the {capacity} cells of the store"
+            )
+
+    def submit(self, spec):
+        """Queues a job and returns it, with whether it was merged into an identical pending job"""
+        runs, steps = self.parse(spec)
+        key = json.dumps(
+            {"runs": [default_params(**run) for run in runs], "steps": steps},
+            sort_keys=True,
+        )
+        if key in self.pending_jobs:
+            return self.pending_jobs[key], True
+        if len(self.pending_jobs) >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} jobs are already queued or running")
+        if self.executor is None:
+            self.start()
+
+        job = Job(uuid.uuid4().hex, key, runs, steps)
+        self.jobs[job.id] = job
+        self.pending_jobs[key] = job
+        self.pending_runs.extend((job, run) for run in range(len(runs)))
+        self.dispatch()
+        return job, False
+
+    def dispatch(self):
+        while self.pending_runs and self.n_running < self.n_workers:
+            job, run = self.pending_runs[0]
+            try:
+                future = self.executor.submit(
+                    run_model, job.id, run, job.runs[run], job.steps, self.report_every
+                )
+            except BrokenProcessPool:
+                # The runs of the broken pool fail through their futures, this run is retried on a new pool
+                self.start_pool()
+                continue
+            self.pending_runs.popleft()
+            job.state = "running"
+            future.add_done_callback(self.on_done(job, run, self.executor))
+            self.n_running += 1
+
+    def on_done(self, job, run, executor):
+        # Futures complete in a thread of the pool, the run is finished in the server's event loop
+        def callback(future):
+            self.io_loop.add_callback(self.finish_run, job, run, future, executor)
+
+        return callback
+
+    def read_progress(self):
+        while True:
+            job_id, run, rows = self.progress_queue.get()
+            self.io_loop.add_callback(self.add_progress, job_id, run, rows)
+
+    def add_progress(self, job_id, run, rows):
+        job = self.jobs.get(job_id)
+        # Progress read after the run has finished is already part of its result
+        if (job is None) or job.run_finished[run]:
+            return None
+        job.add_rows(run, rows)
+        for listener in list(job.listeners):
+            listener.send({"run": run, "series": rows})
+
+    def finish_run(self, job, run, future, executor):
+        self.n_running -= 1
+        job.finished_runs += 1
+        job.run_finished[run] = True
+        if future.exception() is not None:
+            job.error = repr(future.exception())
+            # A worker died, the pool cannot run anything else and is replaced
+            if isinstance(future.exception(), BrokenProcessPool) & (
+                executor is self.executor
+            ):
+                self.start_pool()
+        else:
+            # The result replaces the progress received so far
+            job.series[run] = {}
+            job.add_rows(run, future.result())
+            for listener in list(job.listeners):
+                listener.send({"run": run, "series": job.series[run], "final": True})
+
+        if job.finished_runs == len(job.runs):
+            job.state = "failed" if job.error else "done"
+            del self.pending_jobs[job.key]
+            for listener in list(job.listeners):
+                listener.send(job.status())
+                listener.close()
+            self.remove_finished()
+        self.dispatch()
+
+    def remove_finished(self):
+        finished = [
+            job for job in self.jobs.values() if job.key not in self.pending_jobs
+        ]
+        for job in finished[: max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job.id]
+
+
+class JobsHandler(tornado.web.RequestHandler):
+    def initialize(self, job_queue):
+        self.job_queue = job_queue
+
+    def post(self):
+        try:
+            spec = json.loads(self.request.body or b"{}")
+            if not isinstance(spec, dict):
+                raise ValueError("The job must be an object")
+            job, merged = self.job_queue.submit(spec)
+        except ValueError as e:
+            self.set_status(400)
+            self.finish({"error": str(e)})
+        except QueueFull as e:
+            self.set_status(429)
+            self.set_header("Retry-After", "5")
+            self.finish({"error": str(e)})
+        else:
+            self.set_status(202)
+            self.finish(dict(job.status(), merged=merged))
+
+
+class JobHandler(tornado.web.RequestHandler):
+    def initialize(self, job_queue):
+        self.job_queue = job_queue
+
+    def get(self, job_id):
+        job = self.job_queue.jobs.get(job_id)
+        if job is None:
+            raise tornado.web.HTTPError(404)
+        self.finish(dict(job.status(), series=job.series))
+
+
+class JobStreamHandler(tornado.websocket.WebSocketHandler):
+    def initialize(self, job_queue):
+        self.job_queue = job_queue
+        self.job = None
+
+    def open(self, job_id):
+        self.job = self.job_queue.jobs.get(job_id)
+        if self.job is None:
+            self.close(code=4004, reason="Unknown job")
+            return None
+        # Start with the time series produced so far
+        for run, series in enumerate(self.job.series):
+            if series:
+                self.send({"run": run, "series": series})
+        if self.job.state in ("done", "failed"):
+            self.send(self.job.status())
+            self.close()
+        else:
+            self.job.listeners.add(self)
+
+    def send(self, message):
+        try:
+            self.write_message(json.dumps(message))
+        except tornado.websocket.WebSocketClosedError:
+            self.job.listeners.discard(self)
+
+    def on_close(self):
+        if self.job is not None:
+            self.job.listeners.discard(self)
+
+
+def make_app(job_queue):
+    args = {"job_queue": job_queue}
+    return tornado.web.Application(
+        [
+            (r"/jobs", JobsHandler, args),
+            (r"/jobs/([0-9a-f]+)", JobHandler, args),
+            (r"/jobs/([0-9a-f]+)/stream", JobStreamHandler, args),
+        ]
+    )
@@ -1,128 +1,210 @@
-from mesa import Agent, Model
-from mesa.time import RandomActivation
+from mesa import Model
+from mesa.time import BaseScheduler, RandomActivation
 from mesa.datacollection import DataCollector
 from mesa.space import SingleGrid
-from mesa.visualization.UserParam import UserSettableParameter
+from collections import namedtuple
 import numpy as np
-import random
-
+from recorder import (
+    Recorder,
+    Replay,
+    TransmissionLog,
+    STRATA,
+    INFECTED,
+    RECOVERED,
+    DEAD,
+)
+
+# User-settable parameters, independent of the visualization so that the model can be used without it
+Parameter = namedtuple(
+    "Parameter",
+    ["param_type", "name", "value", "min_value", "max_value", "step"],
+    defaults=[None, None, 1],
+)
 
 model_params = {
-    "n_adults": UserSettableParameter("slider", "Adults", 28, 0, 100, 1),
-    "n_children": UserSettableParameter("slider", "Children", 28, 0, 100, 1),
-    "n_elderly": UserSettableParameter("slider", "Elderly", 28, 0, 100, 1),
-    "n_pregnant": UserSettableParameter("slider", "Pregnant", 28, 0, 100, 1),
-    "infect_adults": UserSettableParameter(
-        "number", "Initial Infected Adults", 7, 0, 100, 1
-    ),
-    "infect_children": UserSettableParameter(
-        "number", "Initial Infected Children", 7, 0, 100, 1
-    ),
-    "infect_elderly": UserSettableParameter(
-        "number", "Initial Infected Elderly", 7, 0, 100, 1
-    ),
-    "infect_pregnant": UserSettableParameter(
-        "number", "Initial Infected Pregnant", 7, 0, 100, 1
-    ),
-    "infection_period": UserSettableParameter(
-        "slider", "Infection Period", 20, 0, 100, 1
-    ),
-    "v_adults": UserSettableParameter("number", "Vaccinated Adults", 0, 0, 100, 1),
-    "v_children": UserSettableParameter("number", "Vaccinated Children", 0, 0, 100, 1),
-    "v_elderly": UserSettableParameter("number", "Vaccinated Elderly", 0, 0, 100, 1),
-    "v_pregnant": UserSettableParameter("number", "Vaccinated Pregnant", 0, 0, 100, 1),
-    "fatal_adults": UserSettableParameter(
+    "n_adults": Parameter("slider", "Adults", 28, 0, 100, 1),
+    "n_children": Parameter("slider", "Children", 28, 0, 100, 1),
+    "n_elderly": Parameter("slider", "Elderly", 28, 0, 100, 1),
+    "n_pregnant": Parameter("slider", "Pregnant", 28, 0, 100, 1),
+    "infect_adults": Parameter("number", "Initial Infected Adults", 7, 0, 100, 1),
+    "infect_children": Parameter("number", "Initial Infected Children", 7, 0, 100, 1),
+    "infect_elderly": Parameter("number", "Initial Infected Elderly", 7, 0, 100, 1),
+    "infect_pregnant": Parameter("number", "Initial Infected Pregnant", 7, 0, 100, 1),
+    "infection_period": Parameter("slider", "Infection Period", 20, 0, 100, 1),
+    "v_adults": Parameter("number", "Vaccinated Adults", 0, 0, 100, 1),
+    "v_children": Parameter("number", "Vaccinated Children", 0, 0, 100, 1),
+    "v_elderly": Parameter("number", "Vaccinated Elderly", 0, 0, 100, 1),
+    "v_pregnant": Parameter("number", "Vaccinated Pregnant", 0, 0, 100, 1),
+    "fatal_adults": Parameter(
         "number", "Fatality Risk in Adults (%)", 0.02, 0, 100, 0.1
     ),
-    "fatal_children": UserSettableParameter(
+    "fatal_children": Parameter(
         "number", "Fatality Risk in Children (%)", 0.002, 0, 100, 0.1
     ),
-    "fatal_elderly": UserSettableParameter(
+    "fatal_elderly": Parameter(
         "number", "Fatality Risk in Elderly (%)", 0.009, 0, 100, 0.1
     ),
-    "fatal_pregnant": UserSettableParameter(
+    "fatal_pregnant": Parameter(
         "number", "Fatality Risk in Pregnant (%)", 6, 0, 100, 0.1
     ),
-    "transmission": UserSettableParameter(
-        "number", "Transmission Probability", 0.03, 0, 1, 0.01
-    ),
-    "contact_aa": UserSettableParameter(
-        "number", "Contact Rate (Adult-Adult)", 10, 0, 100, 1
-    ),
-    "contact_ac": UserSettableParameter(
-        "number", "Contact Rate (Adult-Child)", 3, 0, 100, 1
-    ),
-    "contact_ae": UserSettableParameter(
-        "number", "Contact Rate (Adult-Elder)", 1, 0, 100, 1
-    ),
-    "contact_cc": UserSettableParameter(
-        "number", "Contact Rate (Child-Child)", 6, 0, 100, 1
-    ),
-    "contact_ce": UserSettableParameter(
-        "number", "Contact Rate (Child-Elder)", 1, 0, 100, 1
-    ),
-    "contact_ca": UserSettableParameter(
-        "number", "Contact Rate (Child-Adult)", 6, 0, 100, 1
-    ),
-    "contact_ee": UserSettableParameter(
-        "number", "Contact Rate (Elder-Elder)", 2, 0, 100, 1
-    ),
-    "contact_ec": UserSettableParameter(
-        "number", "Contact Rate (Elder-Child)", 1, 0, 100, 1
-    ),
-    "contact_ea": UserSettableParameter(
-        "number", "Contact Rate (Elder-Adult)", 5, 0, 100, 1
+    "transmission": Parameter("number", "Transmission Probability", 0.03, 0, 1, 0.01),
+    "contact_aa": Parameter("number", "Contact Rate (Adult-Adult)", 10, 0, 100, 1),
+    "contact_ac": Parameter("number", "Contact Rate (Adult-Child)", 3, 0, 100, 1),
+    "contact_ae": Parameter("number", "Contact Rate (Adult-Elder)", 1, 0, 100, 1),
+    "contact_cc": Parameter("number", "Contact Rate (Child-Child)", 6, 0, 100, 1),
+    "contact_ce": Parameter("number", "Contact Rate (Child-Elder)", 1, 0, 100, 1),
+    "contact_ca": Parameter("number", "Contact Rate (Child-Adult)", 6, 0, 100, 1),
+    "contact_ee": Parameter("number", "Contact Rate (Elder-Elder)", 2, 0, 100, 1),
+    "contact_ec": Parameter("number", "Contact Rate (Elder-Child)", 1, 0, 100, 1),
+    "contact_ea": Parameter("number", "Contact Rate (Elder-Adult)", 5, 0, 100, 1),
+    "open_store": Parameter("checkbox", "Open Store", False),
+    "arrival_rate": Parameter(
+        "number", "Arrival Rate (customers per step)", 2, 0, 100, 0.1
     ),
+    "dwell_time": Parameter("slider", "Mean Dwell Time (steps)", 60, 1, 500, 1),
+    "arrival_infected": Parameter("number", "Infected Arrivals (%)", 25, 0, 100, 1),
+    "arrival_vaccinated": Parameter("number", "Vaccinated Arrivals (%)", 0, 0, 100, 1),
     "width": 50,
     "height": 50,
 }
 
 
-class Agent(Agent):
-    """Agents in the SIR model"""
+def default_params(**overrides):
+    """Returns the default value of every model parameter, with the given parameters overridden"""
+    params = {
+        name: param.value if isinstance(param, Parameter) else param
+        for name, param in model_params.items()
+    }
+    params.update(overrides)
+    return params
+
+
+model_reporters = {
+    "Total Susceptible": "total_susceptible",
+    "Total Infected": "total_infected",
+    "Total Recovered": "total_recovered",
+    "Total Dead": "total_dead",
+    "Susceptible Adults": "susceptible_adults",
+    "Susceptible Children": "susceptible_children",
+    "Susceptible Elderly": "susceptible_elderly",
+    "Infected Adults": "infected_adults",
+    "Infected Children": "infected_children",
+    "Infected Elderly": "infected_elderly",
+    "Recovered Adults": "recovered_adults",
+    "Recovered Children": "recovered_children",
+    "Recovered Elderly": "recovered_elderly",
+    "Susceptible Pregnant": "susceptible_pregnant",
+    "Infected Pregnant": "infected_pregnant",
+    "Recovered Pregnant": "recovered_pregnant",
+    "Dead Adults": "dead_adults",
+    "Dead Children": "dead_children",
+    "Dead Elderly": "dead_elderly",
+    "Dead Pregnant": "dead_pregnant",
+    "Total Arrived": "total_arrived",
+    "Total Departed": "total_departed",
+}
+
+# Cells of the aisles of the store
+aisles = (
+    [(10, y) for y in range(10, 23)]
+    + [(10, y) for y in range(28, 41)]
+    + [(20, y) for y in range(10, 23)]
+    + [(20, y) for y in range(28, 41)]
+    + [(30, y) for y in range(10, 23)]
+    + [(30, y) for y in range(28, 41)]
+    + [(40, y) for y in range(10, 23)]
+    + [(40, y) for y in range(28, 41)]
+)
+
+
+def store_capacity(width, height):
+    """Returns the number of agents that fit in the store, one per cell outside of the aisles"""
+    return width * height - len(aisles)
+
+
+class Agent:
+    """
+    Agents in the SIR model.
+    Only the per-agent state is stored on each agent, the parameters shared by all agents (contact matrix, transmission probability, fatality risks) are read from the model.
+    """
+
+    __slots__ = (
+        "unique_id",
+        "model",
+        "pos",
+        "strata",
+        "infected",
+        "recovered",
+        "dead",
+        "recovery_steps",
+        "fatality",
+        "dwell_steps",
+        "leaving",
+    )
+    type = "agent"
 
     def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        self.type = "agent"
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
         self.strata = None
-        self.contact_aa = self.model.contact_aa
-        self.contact_ac = self.model.contact_ac
-        self.contact_ae = self.model.contact_ae
-        self.contact_cc = self.model.contact_cc
-        self.contact_ce = self.model.contact_ce
-        self.contact_ca = self.model.contact_ca
-        self.contact_ee = self.model.contact_ee
-        self.contact_ec = self.model.contact_ec
-        self.contact_ea = self.model.contact_ea
-        self.contact_matrix = self.model.contact_matrix
-        self.transmission = self.model.transmission
         self.infected = False
         self.recovered = False
         self.dead = False
-        if self.infected:
-            self.recovery_steps = self.model.infection_period
-        else:
-            self.recovery_steps = 0
+        self.recovery_steps = 0
+        self.fatality = self.model.fatality
+        self.dwell_steps = 0
+        self.leaving = False
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def reset(self):
+        """Clear the per-visit state so a departed agent can be reused for a new arrival"""
+        self.strata = None
+        self.infected = False
+        self.recovered = False
+        self.dead = False
+        self.recovery_steps = 0
         self.fatality = self.model.fatality
+        self.dwell_steps = 0
+        self.leaving = False
 
     def move(self):
         if self.type != "wall":
-            if not self.dead:
+            if self.leaving & (not self.dead):
+                # Head for the nearest entrance, taking the free neighboring cell closest to it
+                possible_steps = [
+                    pos
+                    for pos in self.model.grid.get_neighborhood(
+                        self.pos, moore=True, include_center=False
+                    )
+                    if self.model.grid.is_cell_empty(pos)
+                ]
+                if possible_steps:
+                    self.model.grid.move_agent(
+                        self, min(possible_steps, key=self.model.exit_distance)
+                    )
+            elif not self.dead:
                 # Move agent to a random cell in the radius of 1, if there is no empty cell, agent stays in place
-                possible_steps = self.model.grid.get_neighborhood(
-                    self.pos, moore=True, include_center=False
-                )
-                new_x, new_y = self.random.choice(possible_steps)
-                while self.model.grid.is_cell_empty((new_x, new_y)) == False:
+                possible_steps = [
+                    pos
+                    for pos in self.model.grid.get_neighborhood(
+                        self.pos, moore=True, include_center=False
+                    )
+                    if self.model.grid.is_cell_empty(pos)
+                ]
+                if possible_steps:
                     new_x, new_y = self.random.choice(possible_steps)
-                self.model.grid.move_agent(self, (new_x, new_y))
+                    self.model.grid.move_agent(self, (new_x, new_y))
 
     def new_infected(self):
         # Fatality rate
         if self.infected:
             if self.strata == "adult":
                 if self.fatality == None:
-                    self.fatality = random.random() < self.model.fatal_adults / 100
+                    self.fatality = self.random.random() < self.model.fatal_adults / 100
                 elif self.fatality == True:
                     self.dead = True
                     self.infected = False
@@ -132,7 +214,9 @@ class Agent(Agent):
                     self.fatality = False
             if self.strata == "child":
                 if self.fatality == None:
-                    self.fatality = random.random() < self.model.fatal_children / 100
+                    self.fatality = (
+                        self.random.random() < self.model.fatal_children / 100
+                    )
                 elif self.fatality == True:
                     self.dead = True
                     self.infected = False
@@ -142,7 +226,9 @@ class Agent(Agent):
                     self.fatality = False
             if self.strata == "elder":
                 if self.fatality == None:
-                    self.fatality = random.random() < self.model.fatal_elderly / 100
+                    self.fatality = (
+                        self.random.random() < self.model.fatal_elderly / 100
+                    )
                 elif self.fatality == True:
                     self.dead = True
                     self.infected = False
@@ -152,7 +238,9 @@ class Agent(Agent):
                     self.fatality = False
             if self.strata == "pregnant":
                 if self.fatality == None:
-                    self.fatality = random.random() < self.model.fatal_pregnant / 100
+                    self.fatality = (
+                        self.random.random() < self.model.fatal_pregnant / 100
+                    )
                 elif self.fatality == True:
                     self.dead = True
                     self.infected = False
@@ -172,14 +260,21 @@ class Agent(Agent):
         for a in neighbors:
             if a.infected:
                 infection = True
-                if self.contact_matrix[self.strata][a.strata] > contact_rate:
-                    contact_rate = self.contact_matrix[self.strata][a.strata]
+                if self.model.contact_matrix[self.strata][a.strata] > contact_rate:
+                    contact_rate = self.model.contact_matrix[self.strata][a.strata]
 
         # If any of the agents in the neighborhood are infected, the agent has a probability of getting infected
         if infection:
-            if random.random() < self.transmission * contact_rate:
+            if self.random.random() < self.model.transmission * contact_rate:
                 self.infected = True
                 self.recovery_steps = self.model.infection_period
+                if self.model.transmission_log is not None:
+                    # Logged at the tick of the first recorded frame in which the agent is infected
+                    self.model.transmission_log.log(
+                        self.model.schedule.steps + 1,
+                        self,
+                        [a for a in neighbors if a.infected],
+                    )
 
     def new_recovered(self):
         if self.type != "wall":
@@ -189,17 +284,35 @@ class Agent(Agent):
             if self.recovery_steps > 0:
                 self.recovery_steps += -1
 
+    def new_departed(self):
+        # Only customers of an open store leave
+        if (not self.model.open_store) | (self.type == "wall"):
+            return None
+        # Dead customers have already been removed from the grid, they are counted and their object is reused
+        if self.dead:
+            self.model.remove_dead(self)
+            return None
+        if self.dwell_steps > 0:
+            self.dwell_steps += -1
+        if self.dwell_steps == 0:
+            self.leaving = True
+        if self.leaving & (self.pos in self.model.entrances):
+            self.model.depart(self)
+
     def step(self):
         self.move()
         self.new_infected()
         self.new_recovered()
+        self.new_departed()
 
 
 class Wall(Agent):
-    def __init__(self, pos, model, agent_type):
+    __slots__ = ()
+    type = "wall"
+
+    def __init__(self, pos, model):
         super().__init__(pos, model)
         self.pos = pos
-        self.type = agent_type
 
 
 class SIR(Model):
@@ -239,12 +352,27 @@ class SIR(Model):
         contact_ea,
         width,
         height,
+        open_store=False,
+        arrival_rate=2,
+        dwell_time=60,
+        arrival_infected=25,
+        arrival_vaccinated=0,
+        record_path=None,
+        transmission_log_path=None,
+        seed=None,
     ):
+        # The seed of the model's random number generator (self.random) is read by Model.__new__,
+        # the numpy random number generator of the model is seeded with it too so that seeded runs are reproducible
+        self.rng = np.random.default_rng(seed)
         self.n_adults = n_adults
         self.n_elderly = n_elderly
         self.n_children = n_children
         self.n_pregnant = n_pregnant
         self.n_agents = n_adults + n_elderly + n_children + n_pregnant
+        if self.n_agents > store_capacity(width, height):
+            raise ValueError(
+                f"{self.n_agents} agents do not fit in a store of {store_capacity(width, height)} cells"
+            )
         self.v_adults = v_adults
         self.v_elderly = v_elderly
         self.v_children = v_children
@@ -299,32 +427,35 @@ class SIR(Model):
         self.schedule = RandomActivation(self)
         self.running = True
 
-        # Create aisles
-        walls = (
-            [(10, y) for y in range(10, 23)]
-            + [(10, y) for y in range(28, 41)]
-            + [(20, y) for y in range(10, 23)]
-            + [(20, y) for y in range(28, 41)]
-            + [(30, y) for y in range(10, 23)]
-            + [(30, y) for y in range(28, 41)]
-            + [(40, y) for y in range(10, 23)]
-            + [(40, y) for y in range(28, 41)]
-        )
+        # Open-store mode: customers arrive and leave through the entrances
+        self.open_store = open_store
+        self.arrival_rate = arrival_rate
+        self.dwell_time = dwell_time
+        self.arrival_infected = arrival_infected
+        self.arrival_vaccinated = arrival_vaccinated
+        self.entrances = [(0, y) for y in range(23, 28)]
+        self.total_arrived = 0
+        self.total_departed = 0
+        self.next_agent_id = self.n_agents
+        # Departed agents are kept here and reused for later arrivals instead of creating new objects
+        self.agent_pool = []
+        # Dead customers are removed from the schedule and only counted
+        self.dead_customers = {"adult": 0, "child": 0, "elder": 0, "pregnant": 0}
 
-        for pos in walls:
-            agent_type = "wall"
-            agent = Wall(pos, self, agent_type)
+        # Create aisles
+        for pos in aisles:
+            agent = Wall(pos, self)
             self.grid.position_agent(agent, pos[0], pos[1])
             self.schedule.add(agent)
 
         ###############
         # Create agents
         ###############
-        # Array of population strata
-        adult_arr = np.array(["adult"] * self.n_adults)
-        elder_arr = np.array(["elder"] * self.n_elderly)
-        child_arr = np.array(["child"] * self.n_children)
-        pregnant_arr = np.array(["pregnant"] * self.n_pregnant)
+        # Array of population strata, stored as objects so every agent of a strata shares the same string
+        adult_arr = np.array(["adult"] * self.n_adults, dtype=object)
+        elder_arr = np.array(["elder"] * self.n_elderly, dtype=object)
+        child_arr = np.array(["child"] * self.n_children, dtype=object)
+        pregnant_arr = np.array(["pregnant"] * self.n_pregnant, dtype=object)
 
         # Concatentate strata arrays
         strata_arr = np.concatenate((adult_arr, elder_arr, child_arr, pregnant_arr))
@@ -344,10 +475,10 @@ class SIR(Model):
         )
 
         # Randomize initially vaccinated agents
-        np.random.shuffle(vaccinated_adults)
-        np.random.shuffle(vaccinated_elderly)
-        np.random.shuffle(vaccinated_children)
-        np.random.shuffle(vaccinated_pregnant)
+        self.rng.shuffle(vaccinated_adults)
+        self.rng.shuffle(vaccinated_elderly)
+        self.rng.shuffle(vaccinated_children)
+        self.rng.shuffle(vaccinated_pregnant)
 
         # Concatenate vaccinated arrays in the same order as age array
         vaccinated_arr = np.concatenate(
@@ -366,16 +497,16 @@ class SIR(Model):
         unvaccinated_pregnant = np.where(vaccinated_pregnant == False)[0]
 
         # Randomly infect agents
-        init_inf_adults = np.random.choice(
+        init_inf_adults = self.rng.choice(
             unvaccinated_adults, size=self.infect_adults, replace=False
         )
-        init_inf_elderly = np.random.choice(
+        init_inf_elderly = self.rng.choice(
             unvaccinated_elderly, size=self.infect_elderly, replace=False
         )
-        init_inf_children = np.random.choice(
+        init_inf_children = self.rng.choice(
             unvaccinated_children, size=self.infect_children, replace=False
         )
-        init_inf_pregnant = np.random.choice(
+        init_inf_pregnant = self.rng.choice(
             unvaccinated_pregnant, size=self.infect_pregnant, replace=False
         )
 
@@ -404,11 +535,11 @@ class SIR(Model):
         for i in range(self.n_agents):
             a = Agent(i, self)
             self.schedule.add(a)
-            a.infected = infected_arr[i]
+            a.infected = bool(infected_arr[i])
             if a.infected:
                 a.recovery_steps = self.infection_period
             a.strata = strata_arr[i]
-            a.recovered = vaccinated_arr[i]
+            a.recovered = bool(vaccinated_arr[i])
 
             # Place agent on a random cell that is not occupied
             x = self.random.randrange(self.grid.width)
@@ -417,31 +548,97 @@ class SIR(Model):
                 x = self.random.randrange(self.grid.width)
                 y = self.random.randrange(self.grid.height)
             self.grid.place_agent(a, (x, y))
+            if self.open_store:
+                a.dwell_steps = self.new_dwell_steps()
 
-        self.datacollector = DataCollector(
-            {
-                "Total Susceptible": "total_susceptible",
-                "Total Infected": "total_infected",
-                "Total Recovered": "total_recovered",
-                "Total Dead": "total_dead",
-                "Susceptible Adults": "susceptible_adults",
-                "Susceptible Children": "susceptible_children",
-                "Susceptible Elderly": "susceptible_elderly",
-                "Infected Adults": "infected_adults",
-                "Infected Children": "infected_children",
-                "Infected Elderly": "infected_elderly",
-                "Recovered Adults": "recovered_adults",
-                "Recovered Children": "recovered_children",
-                "Recovered Elderly": "recovered_elderly",
-                "Susceptible Pregnant": "susceptible_pregnant",
-                "Infected Pregnant": "infected_pregnant",
-                "Recovered Pregnant": "recovered_pregnant",
-                "Dead Adults": "dead_adults",
-                "Dead Children": "dead_children",
-                "Dead Elderly": "dead_elderly",
-                "Dead Pregnant": "dead_pregnant",
-            }
-        )
+        self.datacollector = DataCollector(model_reporters)
+
+        # Optionally record the state of every agent at each tick for replays
+        if record_path is not None:
+            self.recorder = Recorder(record_path, self)
+        else:
+            self.recorder = None
+
+        # Optionally log who infected whom, starting with the initially infected agents
+        if transmission_log_path is not None:
+            self.transmission_log = TransmissionLog(transmission_log_path, self)
+        else:
+            self.transmission_log = None
+
+    def new_dwell_steps(self):
+        # Time spent in the store is exponentially distributed around the mean dwell time
+        return max(1, round(self.random.expovariate(1 / max(self.dwell_time, 1))))
+
+    def exit_distance(self, pos):
+        # Squared distance to the nearest entrance, wrapping around the edges of the toroidal grid
+        distances = []
+        for ex, ey in self.entrances:
+            dx = abs(pos[0] - ex)
+            dy = abs(pos[1] - ey)
+            dx = min(dx, self.grid.width - dx)
+            dy = min(dy, self.grid.height - dy)
+            distances.append(dx * dx + dy * dy)
+        return min(distances)
+
+    def depart(self, agent):
+        """Remove a customer from the store and keep its object for reuse"""
+        self.grid.remove_agent(agent)
+        self.schedule.remove(agent)
+        self.agent_pool.append(agent)
+        self.total_departed += 1
+
+    def remove_dead(self, agent):
+        """Count a customer who died in the store and keep its object for reuse"""
+        self.schedule.remove(agent)
+        self.agent_pool.append(agent)
+        self.dead_customers[agent.strata] += 1
+
+    def arrive(self):
+        """Let new customers in through the free entrance cells"""
+        # Arrivals follow the strata mix of the initial population, or an even mix if the store opens empty
+        strata_weights = {
+            "adult": self.n_adults,
+            "child": self.n_children,
+            "elder": self.n_elderly,
+            "pregnant": self.n_pregnant,
+        }
+        if self.n_agents == 0:
+            strata_weights = dict.fromkeys(strata_weights, 1)
+        n_arrivals = self.rng.poisson(self.arrival_rate)
+        for _ in range(n_arrivals):
+            free_entrances = [
+                pos for pos in self.entrances if self.grid.is_cell_empty(pos)
+            ]
+            # Customers who find every entrance blocked do not come in
+            if not free_entrances:
+                break
+
+            # Reused objects get a new unique id, so that an id always refers to the same customer
+            if self.agent_pool:
+                a = self.agent_pool.pop()
+                a.reset()
+                a.unique_id = self.next_agent_id
+            else:
+                a = Agent(self.next_agent_id, self)
+            self.next_agent_id += 1
+
+            a.strata = self.random.choices(
+                list(strata_weights), list(strata_weights.values())
+            )[0]
+            # Vaccination and infection among arrivals are set on their own, apart from the initial population
+            r = self.random.random() * 100
+            if r < self.arrival_vaccinated:
+                a.recovered = True
+            elif r < self.arrival_vaccinated + self.arrival_infected:
+                a.infected = True
+                a.recovery_steps = self.infection_period
+            a.dwell_steps = self.new_dwell_steps()
+
+            self.schedule.add(a)
+            self.grid.place_agent(a, self.random.choice(free_entrances))
+            self.total_arrived += 1
+            if a.infected & (self.transmission_log is not None):
+                self.transmission_log.log(self.schedule.steps, a, [])
 
     @property
     def susceptible_adults(self):
@@ -591,25 +788,25 @@ class SIR(Model):
     def dead_adults(self):
         agents = self.schedule.agents
         dead = [a.dead & (a.strata == "adult") for a in agents]
-        return int(np.sum(dead))
+        return int(np.sum(dead)) + self.dead_customers["adult"]
 
     @property
     def dead_children(self):
         agents = self.schedule.agents
         dead = [a.dead & (a.strata == "child") for a in agents]
-        return int(np.sum(dead))
+        return int(np.sum(dead)) + self.dead_customers["child"]
 
     @property
     def dead_elderly(self):
         agents = self.schedule.agents
         dead = [a.dead & (a.strata == "elder") for a in agents]
-        return int(np.sum(dead))
+        return int(np.sum(dead)) + self.dead_customers["elder"]
 
     @property
     def dead_pregnant(self):
         agents = self.schedule.agents
         dead = [a.dead & (a.strata == "pregnant") for a in agents]
-        return int(np.sum(dead))
+        return int(np.sum(dead)) + self.dead_customers["pregnant"]
 
     @property
     def total_susceptible(self):
@@ -649,4 +846,70 @@ class SIR(Model):
 
     def step(self):
         self.datacollector.collect(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
         self.schedule.step()
+        if self.open_store:
+            self.arrive()
+
+
+class ReplaySIR(SIR):
+    """
+    Replays a run of the SIR model recorded with record_path, without simulating it.
+    Set the tick to start from and the number of recorded ticks to advance at each step on the left panel, then click the "Reset" button.
+    """
+
+    def __init__(self, path, start_tick=0, ticks_per_step=1):
+        self.replay = Replay(path)
+        self.grid = SingleGrid(self.replay.width, self.replay.height, True)
+        self.schedule = BaseScheduler(self)
+        self.running = True
+        self.fatality = None
+        # The start tick comes from the left panel, it is rounded down and kept within the recorded ticks
+        self.tick = max(0, min(int(start_tick), self.replay.n_ticks - 1))
+        self.ticks_per_step = ticks_per_step
+
+        for pos in self.replay.walls:
+            agent = Wall(pos, self)
+            self.grid.position_agent(agent, pos[0], pos[1])
+            self.schedule.add(agent)
+
+        # Agents are reused from one frame to the next
+        self.frame_agents = []
+        self.n_frame_agents = 0
+        self.show_frame(self.tick)
+        self.datacollector = DataCollector(model_reporters)
+
+    def show_frame(self, tick):
+        for a in self.frame_agents[: self.n_frame_agents]:
+            if not a.dead:
+                self.grid.remove_agent(a)
+            self.schedule.remove(a)
+
+        ids, positions, strata, states = self.replay.frame(tick)
+        while len(self.frame_agents) < len(ids):
+            self.frame_agents.append(Agent(None, self))
+        self.n_frame_agents = len(ids)
+        for i in range(len(ids)):
+            a = self.frame_agents[i]
+            a.unique_id = int(ids[i])
+            a.strata = STRATA[strata[i]]
+            a.infected = bool(states[i] == INFECTED)
+            a.recovered = bool(states[i] == RECOVERED)
+            a.dead = bool(states[i] == DEAD)
+            self.schedule.add(a)
+            if not a.dead:
+                self.grid.place_agent(a, (int(positions[i][0]), int(positions[i][1])))
+        (
+            self.total_arrived,
+            self.total_departed,
+            self.dead_customers,
+        ) = self.replay.totals(tick)
+
+    def step(self):
+        self.datacollector.collect(self)
+        self.tick += self.ticks_per_step
+        if self.tick >= self.replay.n_ticks:
+            self.running = False
+            return None
+        self.show_frame(self.tick)
@@ -0,0 +1,462 @@
+import os
+import numpy as np
+
+# Compartment codes, stored in 2 bits per agent
+SUSCEPTIBLE = 0
+INFECTED = 1
+RECOVERED = 2
+DEAD = 3
+
+# Strata codes, stored in the other 2 bits of the agent's half byte
+STRATA = ("adult", "child", "elder", "pregnant")
+
+
+def pack_codes(codes):
+    """Pack an array of 4-bit codes two to a byte"""
+    if len(codes) % 2:
+        codes = np.append(codes, 0)
+    return (codes[0::2] << 4 | codes[1::2]).astype(np.uint8)
+
+
+def unpack_codes(packed, n):
+    """Unpack the first n 4-bit codes of a packed array"""
+    codes = np.empty(2 * len(packed), dtype=np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 15
+    return codes[:n]
+
+
+# Moves of an agent from one tick to the next, stored in 4 bits per agent.
+# Codes 0 to 8 are a step of -1, 0 or +1 cells in x (code // 3 - 1) and in y (code % 3 - 1),
+# DIED is an agent that is dead (and no longer on the grid), JUMP an agent whose new cell is stored in full.
+DIED = 9
+JUMP = 10
+
+
+class Recorder:
+    """
+    Records the position, strata and compartment of every agent at each tick of an SIR model.
+    Ticks are buffered in memory and written to the record directory in compressed chunks of chunk_size ticks.
+    Agents are kept in a stable order: the ids and cells of agents are only stored when they arrive, together with the indices of the agents that left,
+    and the other agents are stored as a move from their cell at the previous tick. Every agent arrives again at the first tick of a chunk, so that replays can seek to any chunk.
+    Dead agents (who are no longer on the grid) are stored in the last cell index.
+    Dead customers of an open store are removed from the schedule, only their number is recorded.
+    """
+
+    def __init__(self, path, model, chunk_size=500):
+        self.path = path
+        self.model = model
+        self.chunk_size = chunk_size
+        self.closed = False
+        self.width = model.grid.width
+        self.height = model.grid.height
+        self.n_cells = self.width * self.height
+        if self.n_cells >= np.iinfo(np.uint16).max:
+            raise ValueError("Grids of 65535 cells or more cannot be recorded")
+        self.strata_codes = {strata: code for code, strata in enumerate(STRATA)}
+        self.tick = 0
+        # Cell of each agent at the previous tick, by unique id in the order of the recording
+        self.previous = {}
+        self.clear_buffers()
+
+        os.makedirs(self.path, exist_ok=True)
+        walls = [
+            a.pos[0] * model.grid.height + a.pos[1]
+            for a in model.schedule.agents
+            if a.type == "wall"
+        ]
+        np.savez(
+            os.path.join(self.path, "header.npz"),
+            width=model.grid.width,
+            height=model.grid.height,
+            chunk_size=self.chunk_size,
+            walls=np.array(walls, dtype=np.uint16),
+        )
+
+    def clear_buffers(self):
+        self.counts = []
+        self.n_left = []
+        self.left = []
+        self.n_arrived = []
+        self.arrived_ids = []
+        self.arrived_cells = []
+        self.moves = []
+        self.jumps = []
+        self.codes = []
+        self.arrived = []
+        self.departed = []
+        self.dead_customers = []
+
+    def move(self, cell, new_cell):
+        """Returns the move code from one cell to the next, on the torus of the grid"""
+        if new_cell == self.n_cells:
+            return DIED
+        dx = (new_cell // self.height - cell // self.height + 1) % self.width
+        dy = (new_cell % self.height - cell % self.height + 1) % self.height
+        if (cell == self.n_cells) | (dx > 2) | (dy > 2):
+            self.jumps.append(new_cell)
+            return JUMP
+        return dx * 3 + dy
+
+    def record(self, model):
+        if self.closed:
+            raise ValueError("Cannot record to a closed Recorder")
+        # The first tick of a chunk is a key frame, in which every agent arrives
+        if not self.counts:
+            self.previous = {}
+
+        agents = {a.unique_id: a for a in model.schedule.agents if a.type != "wall"}
+        cells = {}
+        for unique_id, a in agents.items():
+            if a.dead:
+                cells[unique_id] = self.n_cells
+            else:
+                cells[unique_id] = a.pos[0] * model.grid.height + a.pos[1]
+
+        left = []
+        current = {}
+        for i, (unique_id, cell) in enumerate(self.previous.items()):
+            if unique_id in cells:
+                self.moves.append(self.move(cell, cells[unique_id]))
+                current[unique_id] = cells[unique_id]
+            else:
+                left.append(i)
+        n_arrived = 0
+        for unique_id, cell in cells.items():
+            if unique_id not in current:
+                self.arrived_ids.append(unique_id)
+                self.arrived_cells.append(cell)
+                current[unique_id] = cell
+                n_arrived += 1
+
+        for unique_id in current:
+            a = agents[unique_id]
+            if a.dead:
+                state = DEAD
+            elif a.infected:
+                state = INFECTED
+            elif a.recovered:
+                state = RECOVERED
+            else:
+                state = SUSCEPTIBLE
+            self.codes.append(self.strata_codes[a.strata] << 2 | state)
+
+        self.previous = current
+        self.counts.append(len(current))
+        self.n_left.append(len(left))
+        self.left.extend(left)
+        self.n_arrived.append(n_arrived)
+        self.arrived.append(model.total_arrived)
+        self.departed.append(model.total_departed)
+        self.dead_customers.append([model.dead_customers[strata] for strata in STRATA])
+
+        self.tick += 1
+        if len(self.counts) == self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        """Write the buffered ticks to a chunk file"""
+        if not self.counts:
+            return None
+        chunk = (self.tick - 1) // self.chunk_size
+        np.savez_compressed(
+            os.path.join(self.path, f"chunk_{chunk:06d}.npz"),
+            counts=np.array(self.counts, dtype=np.uint16),
+            n_left=np.array(self.n_left, dtype=np.uint16),
+            left=np.array(self.left, dtype=np.uint16),
+            n_arrived=np.array(self.n_arrived, dtype=np.uint16),
+            arrived_ids=np.array(self.arrived_ids, dtype=np.uint32),
+            arrived_cells=np.array(self.arrived_cells, dtype=np.uint16),
+            moves=pack_codes(np.array(self.moves, dtype=np.uint8)),
+            jumps=np.array(self.jumps, dtype=np.uint16),
+            codes=pack_codes(np.array(self.codes, dtype=np.uint8)),
+            arrived=np.array(self.arrived, dtype=np.uint32),
+            departed=np.array(self.departed, dtype=np.uint32),
+            dead_customers=np.array(self.dead_customers, dtype=np.uint32),
+        )
+        self.clear_buffers()
+
+    def close(self):
+        """Record the state after the last step and write the remaining ticks, nothing can be recorded afterwards"""
+        if self.closed:
+            return None
+        self.record(self.model)
+        self._flush()
+        self.closed = True
+
+
+class Replay:
+    """Reads the ticks of a run recorded by Recorder, loading one chunk at a time"""
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(os.path.join(self.path, "header.npz")) as header:
+            self.width = int(header["width"])
+            self.height = int(header["height"])
+            self.chunk_size = int(header["chunk_size"])
+            self.walls = [
+                (int(cell) // self.height, int(cell) % self.height)
+                for cell in header["walls"]
+            ]
+        self.n_cells = self.width * self.height
+
+        chunks = sorted(
+            f
+            for f in os.listdir(self.path)
+            if f.startswith("chunk_") and f.endswith(".npz")
+        )
+        self.n_chunks = len(chunks)
+        if self.n_chunks == 0:
+            raise ValueError(
+                f"No ticks were recorded in {self.path}, was the recorder closed?"
+            )
+        self.chunk = None
+        self.chunk_index = None
+        self.n_ticks = (self.n_chunks - 1) * self.chunk_size + len(
+            self.load_chunk(self.n_chunks - 1)["counts"]
+        )
+
+    def load_chunk(self, index):
+        if index != self.chunk_index:
+            with np.load(
+                os.path.join(self.path, f"chunk_{index:06d}.npz")
+            ) as chunk_file:
+                chunk = {key: chunk_file[key] for key in chunk_file.files}
+            counts = chunk["counts"].astype(np.int64)
+            n_moves = counts - chunk["n_arrived"]
+            chunk["moves"] = unpack_codes(chunk["moves"], n_moves.sum())
+            chunk["codes"] = unpack_codes(chunk["codes"], counts.sum())
+            # Where the data of each tick starts in the arrays of the chunk
+            chunk["offsets"] = np.concatenate(([0], np.cumsum(counts)))
+            chunk["left_offsets"] = np.concatenate(
+                ([0], np.cumsum(chunk["n_left"], dtype=np.int64))
+            )
+            chunk["arrived_offsets"] = np.concatenate(
+                ([0], np.cumsum(chunk["n_arrived"], dtype=np.int64))
+            )
+            chunk["move_offsets"] = np.concatenate(([0], np.cumsum(n_moves)))
+            chunk["jump_offsets"] = np.concatenate(
+                ([0], np.cumsum(chunk["moves"] == JUMP))
+            )[chunk["move_offsets"]]
+            self.chunk = chunk
+            self.chunk_index = index
+            # Ids and cells of the agents at the last decoded tick of the chunk
+            self.decoded = -1
+            self.ids = np.empty(0, dtype=np.uint32)
+            self.cells = np.empty(0, dtype=np.int64)
+        return self.chunk
+
+    def decode(self, i):
+        """Applies the arrivals, departures and moves of tick i of the current chunk to the decoded agents"""
+        chunk = self.chunk
+        start, end = chunk["left_offsets"][i], chunk["left_offsets"][i + 1]
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[chunk["left"][start:end]] = False
+        ids, cells = self.ids[keep], self.cells[keep]
+
+        start, end = chunk["move_offsets"][i], chunk["move_offsets"][i + 1]
+        moves = chunk["moves"][start:end].astype(np.int64)
+        x = (cells // self.height + moves // 3 - 1) % self.width
+        y = (cells % self.height + moves % 3 - 1) % self.height
+        cells = np.where(moves == DIED, self.n_cells, x * self.height + y)
+        start, end = chunk["jump_offsets"][i], chunk["jump_offsets"][i + 1]
+        cells[moves == JUMP] = chunk["jumps"][start:end]
+
+        start, end = chunk["arrived_offsets"][i], chunk["arrived_offsets"][i + 1]
+        self.ids = np.concatenate((ids, chunk["arrived_ids"][start:end]))
+        self.cells = np.concatenate((cells, chunk["arrived_cells"][start:end]))
+        self.decoded = i
+
+    def frame(self, tick):
+        """
+        Returns the agents at a tick as arrays of unique ids, positions, strata codes and compartment codes.
+        Dead agents have a position of (-1, -1).
+        """
+        if not 0 <= tick < self.n_ticks:
+            raise IndexError(
+                f"Tick {tick} is outside of the {self.n_ticks} recorded ticks"
+            )
+        chunk = self.load_chunk(tick // self.chunk_size)
+        i = tick % self.chunk_size
+        # Ticks are decoded forward from the key frame at the start of the chunk
+        if i < self.decoded:
+            self.decoded = -1
+            self.ids = np.empty(0, dtype=np.uint32)
+            self.cells = np.empty(0, dtype=np.int64)
+        for j in range(self.decoded + 1, i + 1):
+            self.decode(j)
+
+        codes = chunk["codes"][chunk["offsets"][i] : chunk["offsets"][i + 1]]
+        cells = self.cells
+        x = np.where(cells < self.n_cells, cells // self.height, -1)
+        y = np.where(cells < self.n_cells, cells % self.height, -1)
+        return self.ids, np.stack((x, y), axis=1), codes >> 2, codes & 3
+
+    def totals(self, tick):
+        """
+        Returns the number of arrivals and departures up to a tick, and the number of dead customers of each strata removed from the store.
+        """
+        chunk = self.load_chunk(tick // self.chunk_size)
+        i = tick % self.chunk_size
+        dead_customers = {
+            strata: int(n) for strata, n in zip(STRATA, chunk["dead_customers"][i])
+        }
+        return int(chunk["arrived"][i]), int(chunk["departed"][i]), dead_customers
+
+    def trajectory(self, unique_id):
+        """Returns the tick, position and compartment code of one agent at each tick it was in the store"""
+        trajectory = []
+        for tick in range(self.n_ticks):
+            ids, positions, strata, states = self.frame(tick)
+            for i in np.flatnonzero(ids == unique_id):
+                trajectory.append(
+                    (tick, (int(positions[i][0]), int(positions[i][1])), int(states[i]))
+                )
+        return trajectory
+
+
+class TransmissionLog:
+    """
+    Logs every infection of an SIR model: the tick, the infected agent, its strata and cell, and the infected neighbors that could have been the source.
+    Cases without a source (initially infected agents and infected arrivals) are logged with no candidate sources.
+    The tick of an event is the index of the first Recorder frame in which the agent is infected, the initially infected agents of the model are logged at tick 0.
+    Events are written into preallocated columns and saved to the log directory in compressed batches of capacity events.
+    """
+
+    def __init__(self, path, model, capacity=4096):
+        self.path = path
+        self.height = model.grid.height
+        self.strata_codes = {strata: code for code, strata in enumerate(STRATA)}
+        self.batch = 0
+        self.n_events = 0
+        self.n_sources = 0
+
+        # Columns of the events, an agent has at most 8 neighbors and so at most 8 candidate sources
+        self.ticks = np.empty(capacity, dtype=np.uint32)
+        self.infectees = np.empty(capacity, dtype=np.uint32)
+        self.strata = np.empty(capacity, dtype=np.uint8)
+        self.cells = np.empty(capacity, dtype=np.uint16)
+        self.source_counts = np.empty(capacity, dtype=np.uint8)
+        self.sources = np.empty(8 * capacity, dtype=np.uint32)
+        self.source_strata = np.empty(8 * capacity, dtype=np.uint8)
+
+        os.makedirs(self.path, exist_ok=True)
+        np.savez(
+            os.path.join(self.path, "header.npz"),
+            width=model.grid.width,
+            height=model.grid.height,
+        )
+        for a in model.schedule.agents:
+            if a.infected:
+                self.log(model.schedule.steps, a, [])
+
+    def log(self, tick, agent, sources):
+        if self.n_events == len(self.ticks):
+            self.flush()
+        i = self.n_events
+        self.ticks[i] = tick
+        self.infectees[i] = agent.unique_id
+        self.strata[i] = self.strata_codes[agent.strata]
+        self.cells[i] = agent.pos[0] * self.height + agent.pos[1]
+        self.source_counts[i] = len(sources)
+        for a in sources:
+            self.sources[self.n_sources] = a.unique_id
+            self.source_strata[self.n_sources] = self.strata_codes[a.strata]
+            self.n_sources += 1
+        self.n_events += 1
+
+    def flush(self):
+        """Write the logged events to a batch file"""
+        if self.n_events == 0:
+            return None
+        n, n_sources = self.n_events, self.n_sources
+        np.savez_compressed(
+            os.path.join(self.path, f"transmissions_{self.batch:06d}.npz"),
+            ticks=self.ticks[:n],
+            infectees=self.infectees[:n],
+            strata=self.strata[:n],
+            cells=self.cells[:n],
+            source_counts=self.source_counts[:n],
+            sources=self.sources[:n_sources],
+            source_strata=self.source_strata[:n_sources],
+        )
+        self.batch += 1
+        self.n_events = 0
+        self.n_sources = 0
+
+    def close(self):
+        self.flush()
+
+
+def load_transmissions(path):
+    """
+    Returns the events of a transmission log as a dictionary of columns.
+    The candidate sources of event i are sources[source_offsets[i]:source_offsets[i + 1]].
+    """
+    with np.load(os.path.join(path, "header.npz")) as header:
+        transmissions = {
+            "width": int(header["width"]),
+            "height": int(header["height"]),
+        }
+    batches = sorted(
+        f
+        for f in os.listdir(path)
+        if f.startswith("transmissions_") and f.endswith(".npz")
+    )
+    columns = {
+        "ticks": np.uint32,
+        "infectees": np.uint32,
+        "strata": np.uint8,
+        "cells": np.uint16,
+        "source_counts": np.uint8,
+        "sources": np.uint32,
+        "source_strata": np.uint8,
+    }
+    loaded = {column: [np.empty(0, dtype=dtype)] for column, dtype in columns.items()}
+    for batch in batches:
+        with np.load(os.path.join(path, batch)) as batch_file:
+            for column in columns:
+                loaded[column].append(batch_file[column])
+    for column in columns:
+        transmissions[column] = np.concatenate(loaded[column])
+    transmissions["source_offsets"] = np.concatenate(
+        ([0], np.cumsum(transmissions["source_counts"], dtype=np.int64))
+    )
+    return transmissions
+
+
+def secondary_infections_per_case(transmissions):
+    """
+    Returns the mean number of secondary infections caused by a case of each strata, broken down by the strata of the infected agents.
+    An infection with several candidate sources is attributed in equal parts to each of them.
+    """
+    n_strata = len(STRATA)
+    secondary = np.zeros((n_strata, n_strata))
+    offsets = transmissions["source_offsets"]
+    for i, infectee_strata in enumerate(transmissions["strata"]):
+        source_strata = transmissions["source_strata"][offsets[i] : offsets[i + 1]]
+        if len(source_strata):
+            np.add.at(
+                secondary[:, infectee_strata], source_strata, 1 / len(source_strata)
+            )
+    cases = np.bincount(transmissions["strata"], minlength=n_strata)
+
+    per_case = {}
+    for source, source_name in enumerate(STRATA):
+        per_case[source_name] = {
+            infectee_name: (
+                secondary[source, infectee] / cases[source] if cases[source] else 0.0
+            )
+            for infectee, infectee_name in enumerate(STRATA)
+        }
+    return per_case
+
+
+def infection_hotspots(transmissions):
+    """Returns a width x height array of the number of infections that happened in each cell"""
+    # Cases without a source did not get infected in the store
+    cells = transmissions["cells"][transmissions["source_counts"] > 0]
+    counts = np.bincount(
+        cells, minlength=transmissions["width"] * transmissions["height"]
+    )
+    return counts.reshape(transmissions["width"], transmissions["height"])
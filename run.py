@@ -1,3 +1,27 @@
-from server import server
+import argparse
 
-server.launch()
+# Guarded because the job workers are started with multiprocessing and import this module again,
+# they do not need the visualization server or the job API
+if __name__ == "__main__":
+    from jobs import JobQueue, make_app
+    from server import server, replay_server
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--replay", help="directory of a recorded run to replay")
+    parser.add_argument(
+        "--jobs-port", type=int, help="also serve the job API on this port"
+    )
+    parser.add_argument(
+        "--jobs-address",
+        default="127.0.0.1",
+        help="address to serve the job API on, only this machine by default",
+    )
+    args = parser.parse_args()
+
+    if args.jobs_port:
+        make_app(JobQueue()).listen(args.jobs_port, address=args.jobs_address)
+
+    if args.replay:
+        replay_server(args.replay).launch()
+    else:
+        server.launch()
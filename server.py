@@ -1,8 +1,17 @@
 from mesa.visualization.modules import CanvasGrid, ChartModule
 from mesa.visualization.ModularVisualization import ModularServer
+from mesa.visualization.UserParam import UserSettableParameter
 from model import *
 
 
+def user_params(params):
+    """Adapts the model parameters into UserSettableParameters for the left panel"""
+    return {
+        name: UserSettableParameter(*param) if isinstance(param, Parameter) else param
+        for name, param in params.items()
+    }
+
+
 def agent_portrayal(agent):
     portrayal = {
         "Shape": "circle",
@@ -129,5 +138,21 @@ server = ModularServer(
     SIR,
     [grid, totals, infected, deaths, adults, children, elderly, pregnant],
     "SIR Model of Influenza A/H1N1",
-    model_params,
+    user_params(model_params),
 )
+
+
+def replay_server(path):
+    """Server that replays a run recorded with the record_path parameter of SIR"""
+    n_ticks = Replay(path).n_ticks
+    replay_params = {
+        "path": path,
+        "start_tick": Parameter("slider", "Start Tick", 0, 0, n_ticks - 1, 1),
+        "ticks_per_step": Parameter("slider", "Ticks per Step", 1, 1, 50, 1),
+    }
+    return ModularServer(
+        ReplaySIR,
+        [grid, totals, infected, deaths, adults, children, elderly, pregnant],
+        "SIR Model of Influenza A/H1N1 (Replay)",
+        user_params(replay_params),
+    )